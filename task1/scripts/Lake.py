@@ -1,3 +1,7 @@
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True, slots=True)
 class Lake:
     """
     Class that describes a lake
@@ -10,20 +14,12 @@ class Lake:
     :param coeff: desired % of lake level
     """
 
-    def __init__(self, e, Vmin, Vmax, Qmin, Qmax, coeff):
-        self.e = e
-        self.Vmin = Vmin
-        self._Vmax = Vmax
-        self.Qmin = Qmin
-        self.Qmax = Qmax
-        self.coeff = coeff
-
-    @property
-    def Vmax(self):
-        """
-        Returns Vmax.
-        """
-        return self._Vmax
+    e: float
+    Vmin: float
+    Vmax: float
+    Qmin: float
+    Qmax: float
+    coeff: float
 
     @property
     def V0(self):
@@ -1,5 +1,8 @@
 import os
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 
 from Lake import Lake
 from utils import flowOptimisation
@@ -13,19 +16,25 @@ def main():
     """
 
     # import prices and inflow data and join into one dataframe
+    # pyarrow parses the ISO timestamps natively, without per-row date parsing
     data = pd.read_csv(
         "data/Spot_2023.csv",
         delimiter=";",
         names=["DateTime", "Price"],
-        header=0,
-        parse_dates=["DateTime"],
+        skiprows=1,
+        engine="pyarrow",
     )
     inflow_monthly = pd.read_csv(
-        "data/reservoirs_monthly_mean_inflows.csv", delimiter=";"
+        "data/reservoirs_monthly_mean_inflows.csv", delimiter=";", engine="pyarrow"
     )
     data["Month"] = data["DateTime"].dt.month
-    month_to_inflow = inflow_monthly.set_index("Mois")["Apports [m3/s]"].to_dict()
-    data["Inflow"] = data["Month"].map(month_to_inflow)
+    # month numbers index straight into a lookup array (entry 0 unused);
+    # months missing from the inflow file stay NaN so the gap is visible
+    month_to_inflow = np.full(13, np.nan)
+    month_to_inflow[inflow_monthly["Mois"].to_numpy()] = inflow_monthly[
+        "Apports [m3/s]"
+    ].to_numpy()
+    data["Inflow"] = month_to_inflow[data["Month"].to_numpy()]
 
     # initialise lake
     LakeAlpiq = Lake(
@@ -33,35 +42,43 @@ def main():
     )  # convert e units to MWh
 
     # perform desired optimisation
-    model = flowOptimisation(LakeAlpiq, data)
+    q, v = flowOptimisation(LakeAlpiq, data, december_inflow=month_to_inflow[12])
 
     # save to the dataframe optimised variables and objective
-    data["q"] = [model.q[i]() for i in model.N]
-    data["v"] = [model.v[i]() for i in model.N]
-    data["Revenue [EUR/h]"] = model.e * data["q"] * data["Price"] * 3600
+    data["q"] = q
+    data["v"] = v
+    data["Revenue [EUR/h]"] = (LakeAlpiq.e * 3600.0) * q * data["Price"].to_numpy()
 
     # calculate some monthly quantities (average price, operation hours, ...)
+    # ON/OFF masks are computed once and aggregated with pandas' builtin reductions
+    turbineON = data["q"] > 0
+    turbineOFF = data["q"] == 0
     monthlyAverages = (
-        data.groupby("Month")
-        .apply(
-            lambda group: pd.Series(
-                {
-                    "Average price ON": group["Price"][group["q"] > 0].mean(),
-                    "Average price OFF": group["Price"][group["q"] == 0].mean(),
-                    "Average price": group["Price"].mean(),
-                    "Hours ON": (group["q"] > 0).sum(),
-                    "Hours OFF": (group["q"] == 0).sum(),
-                    "Average revenue [EUR/h]": group["Revenue [EUR/h]"].mean(),
-                    "Total revenue [EUR]": group["Revenue [EUR/h]"].sum(),
-                }
-            )
+        data.assign(
+            _on=turbineON,
+            _off=turbineOFF,
+            _price_on=data["Price"].where(turbineON),
+            _price_off=data["Price"].where(turbineOFF),
+        )
+        .groupby("Month")
+        .agg(
+            **{
+                "Average price ON": ("_price_on", "mean"),
+                "Average price OFF": ("_price_off", "mean"),
+                "Average price": ("Price", "mean"),
+                "Hours ON": ("_on", "sum"),
+                "Hours OFF": ("_off", "sum"),
+                "Average revenue [EUR/h]": ("Revenue [EUR/h]", "mean"),
+                "Total revenue [EUR]": ("Revenue [EUR/h]", "sum"),
+            }
         )
         .reset_index()
     )
 
     # save data
     os.makedirs("output/", exist_ok=True)
-    data.to_csv("output/out.csv")
+    # hourly data goes through pyarrow's C++ csv writer, pandas is fine for 12 months
+    pacsv.write_csv(pa.Table.from_pandas(data, preserve_index=False), "output/out.csv")
     monthlyAverages.to_csv("output/monthly.csv")
     print("Produced output files output/out.csv and output/monthly.csv .")
 
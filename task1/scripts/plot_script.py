@@ -1,6 +1,9 @@
+import matplotlib.dates as mdates
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
+from matplotlib.collections import PolyCollection
+from matplotlib.patches import Patch
 
 from utils import colourON, colourOFF
 
@@ -108,40 +111,49 @@ def operations(data, output):
     Middle: Electricity price [EUR/MWh], colour-coded for regimes of turbine operations.
     Bottom: Lake volume over time. Scaled curve of monthly inflows is overlaid fto improve understanding.
     """
+    # Ranges of all scaled quantities in one aggregation
+    ranges = data[["Price", "q", "Inflow", "v"]].agg(["min", "max"])
+
     # Scale and shift the Price data to match the range of Flow Rate (q)
-    price_min, price_max = data["Price"].min(), data["Price"].max()
-    q_min, q_max = data["q"].min(), data["q"].max()
+    price_min, price_max = ranges["Price"]
+    q_min, q_max = ranges["q"]
     scaled_price = (data["Price"] - price_min) / (price_max - price_min) * (
         q_max - q_min
     ) + q_min
 
     # Scale and shift the Inflow data to match the range of Volume (v)
-    inflow_min, inflow_max = data["Inflow"].min(), data["Inflow"].max()
-    v_min, v_max = data["v"].min(), data["v"].max()
+    inflow_min, inflow_max = ranges["Inflow"]
+    v_min, v_max = ranges["v"]
     scaled_inflow = (data["Inflow"] - inflow_min) / (inflow_max - inflow_min) * (
         v_max - v_min
     ) + v_min
 
+    # Smooth line plots are decimated to ~2000 points, which is plenty for a full year;
+    # the spiky price overlay is drawn at full resolution so its peaks are not aliased away
+    stride = max(1, len(data) // 2000)
+    lines = data.iloc[::stride]
+
     # Create a figure with three vertically stacked subplots
     fig, axs = plt.subplots(3, 1, figsize=(12, 12), sharex=True)
 
     # Plot Flow Rate  on the first subplot with area filled and scaled price overlay
-    axs[0].plot(data["DateTime"], data["q"], color=colourON, linewidth=1)
-
-    # Fill the area below the curve
-    axs[0].fill_between(
-        data["DateTime"], 0, data["q"], color=colourON, alpha=1.0, label="Turbine ON"
-    )
-
-    # Fill the area above the curve (from the curve to q_max)
-    axs[0].fill_between(
-        data["DateTime"],
-        data["q"],
-        q_max,
-        color=colourOFF,
-        alpha=1.0,
-        label="Turbine OFF",
+    axs[0].plot(lines["DateTime"], lines["q"], color=colourON, linewidth=1)
+
+    # Fill the area below the curve (ON) and above it up to q_max (OFF),
+    # both as polygons of a single collection
+    x = mdates.date2num(data["DateTime"])
+    q = data["q"].to_numpy()
+    curve = np.column_stack([x, q])
+    below = np.column_stack([x[::-1], np.zeros(len(x))])
+    above = np.column_stack([x[::-1], np.full(len(x), q_max)])
+    fills = PolyCollection(
+        [np.concatenate([curve, below]), np.concatenate([curve, above])],
+        facecolors=[colourON, colourOFF],
+        edgecolors="none",
     )
+    fills.set_rasterized(True)
+    axs[0].add_collection(fills)
+    axs[0].autoscale_view()
 
     # Overlay the scaled price
     axs[0].plot(
@@ -157,13 +169,27 @@ def operations(data, output):
     axs[0].set_ylabel("Flow rate [m3/s]", fontsize=12)
     axs[0].set_title("Flow rate on turbine with scaled price overlay", fontsize=14)
     axs[0].grid(True, linestyle="--", alpha=0.6)
-    axs[0].legend()
+    handles, _ = axs[0].get_legend_handles_labels()
+    axs[0].legend(
+        handles=[
+            Patch(color=colourON, label="Turbine ON"),
+            Patch(color=colourOFF, label="Turbine OFF"),
+        ]
+        + handles
+    )
 
     # Plot color-coded Price on the second subplot
-    colors = np.where(
-        data["q"] == 50, colourON, np.where(data["q"] == 0, colourOFF, "orange")
+    # 0: ON MAX, 1: OFF, 2: ON MID, looked up in a 3-colour palette
+    codes = np.where(q == 50, 0, np.where(q == 0, 1, 2)).astype(np.int8)
+    colors = np.array([colourON, colourOFF, "orange"])[codes]
+    axs[1].scatter(
+        data["DateTime"],
+        data["Price"],
+        c=colors,
+        label="Price",
+        s=10,
+        rasterized=True,
     )
-    axs[1].scatter(data["DateTime"], data["Price"], c=colors, label="Price", s=10)
     axs[1].set_ylabel("Price [EUR/MWh]", fontsize=12)
     axs[1].set_title("Price at turbine operations", fontsize=14)
     axs[1].grid(True, linestyle="--", alpha=0.6)
@@ -201,11 +227,11 @@ def operations(data, output):
 
     # Plot Volume on the third subplot with scaled Inflow overlay
     axs[2].plot(
-        data["DateTime"], data["v"], label="Lake volume", color="green", linewidth=1
+        lines["DateTime"], lines["v"], label="Lake volume", color="green", linewidth=1
     )
     axs[2].plot(
-        data["DateTime"],
-        scaled_inflow,
+        lines["DateTime"],
+        scaled_inflow.iloc[::stride],
         label="Scaled Inflow",
         color="purple",
         linewidth=1,
@@ -241,26 +267,27 @@ def main():
 
     Creates various plots of operations and revenue.
     """
-    data = pd.read_csv("output/out.csv")
-    data["DateTime"] = pd.to_datetime(data["DateTime"])
-    monthly = pd.read_csv("output/monthly.csv")
+    data = pd.read_csv("output/out.csv", engine="pyarrow")  # parses DateTime itself
+    monthly = pd.read_csv("output/monthly.csv", engine="pyarrow")
 
     # Map Month column to actual month names for x-tick labels
-    month_names = [
-        "January",
-        "February",
-        "March",
-        "April",
-        "May",
-        "June",
-        "July",
-        "August",
-        "September",
-        "October",
-        "November",
-        "December",
-    ]
-    monthly["Month"] = monthly["Month"].map(dict(enumerate(month_names, start=1)))
+    month_names = np.array(
+        [
+            "January",
+            "February",
+            "March",
+            "April",
+            "May",
+            "June",
+            "July",
+            "August",
+            "September",
+            "October",
+            "November",
+            "December",
+        ]
+    )
+    monthly["Month"] = month_names[monthly["Month"].to_numpy() - 1]
 
     # Create plots
     monthlyOperations(monthly, "output/monthlyOperations.png")
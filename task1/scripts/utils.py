@@ -1,68 +1,190 @@
-import pyomo.environ as pyo
+import functools
+import hashlib
+import os
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional, the dispatch loop then runs in pure Python
+
+    def njit(*args, **kwargs):
+        return lambda func: func
+
 
 # plotting colors definitions
 colourON = "mediumseagreen"
 colourOFF = "indianred"
 
 
-def flowOptimisation(Lake, data):
+@njit(cache=True)
+def meritOrderDispatch(prices, q, slack, excess, Qmax, dt):
+    """
+    Inner loop of flowOptimisation, compiled with numba when it is installed.
+    Raises q hour by hour from the highest price down, updating slack and excess in place.
+
+    :param prices: array of prices [EUR/MWh]
+    :param q: array of flows on turbine [m3/s], initialised to Qmin
+    :param slack: array of water that can still be released before each step [m3]
+    :param excess: array of released water above the spill limit before each step [m3]
+    :param Qmax: maximal flow on turbine [m3/s]
+    :param dt: time step [s]
+    """
+    N = prices.shape[0]
+    # stable sort, so tied prices are visited in the same order with and without numba
+    for i in np.argsort(-prices, kind="mergesort"):
+        if prices[i] <= 0:
+            break
+        increase = (Qmax - q[i]) * dt
+        if i < N - 1:  # flow in the last hour does not affect the lake volume
+            increase = min(
+                increase, slack[i + 1 :].min() + min(0.0, excess[: i + 1].min())
+            )
+        if increase <= 0:
+            continue
+        q[i] += increase / dt
+        slack[i + 1 :] -= increase
+        excess[i + 1 :] += increase
+
+
+def flowOptimisation(Lake, data, december_inflow):
+    """
+    Optimises the flow on turbine to maximise revenue without an LP solver.
+
+    With a single lake and a linear objective the LP of flowOptimisationLP is solved
+    exactly by a merit-order dispatch: hours are visited from the highest price down
+    and each gets as much flow as the lake volume bounds still allow, given the flow
+    already assigned to more expensive hours. Water that does not fit below Vmax is
+    spilled (d in flowOptimisationLP).
+
+    :param Lake: Lake object with members e,Vmin,Vmax,Qmin,Qmax
+    :param data: pandas dataframe with columns Price, Inflow
+    :param december_inflow: mean inflow in December [m3/s], sets the final volume
+    :returns: numpy arrays of optimised flow q [m3/s] and lake volume v [m3]
+    """
+    dt = 3600  # 1h steps [s]
+    prices = data["Price"].to_numpy(dtype=np.float64)
+    inflow = data["Inflow"].to_numpy(dtype=np.float64) * dt
+    N = len(prices)
+
+    # v(TF) can be smaller than v(TF+1)=V0 maximally by A(TF)
+    final_volume_min = Lake.V0 - december_inflow * dt
+
+    # Water released on turbine before step i must keep the lake above Vmin (slack >= 0).
+    # Water that would push it above Vmax is spilled, which only matters while the
+    # released water is below that limit (excess < 0).
+    cumulative_inflow = np.concatenate(([0.0], np.cumsum(inflow[:-1])))
+    q = np.full(N, float(Lake.Qmin))
+    released = np.concatenate(([0.0], np.cumsum(q[:-1] * dt)))
+    lowest = np.full(N, float(Lake.Vmin))
+    lowest[-1] = max(Lake.Vmin, final_volume_min)
+    slack = Lake.V0 + cumulative_inflow - lowest - released
+    excess = released - (Lake.V0 + cumulative_inflow - Lake.Vmax)
+
+    meritOrderDispatch(prices, q, slack, excess, float(Lake.Qmax), float(dt))
+
+    # lake volume, spilling only what does not fit below Vmax
+    released = np.concatenate(([0.0], np.cumsum(q[:-1] * dt)))
+    spilled = np.maximum.accumulate(np.maximum(-excess, 0.0))
+    v = Lake.V0 + cumulative_inflow - released - spilled
+
+    return q, v
+
+
+@functools.lru_cache(maxsize=None)
+def balanceMatrix(N, dt):
     """
-    Creates a Pyomo model and defines the mathematical formalism for desired optimisation.
-    Performs optimisation and returns model object.
+    Sparse matrix of the volume balance in flowOptimisationLP, acting on [q, v, d].
+    Depends only on the number of steps, so it is built once per N and reused;
+    each solve then only fills in the inflow right-hand side.
+
+    :param N: number of time steps
+    :param dt: time step [s]
+    :returns: scipy CSR matrix of shape (N - 1, 3 * N)
+    """
+    import scipy.sparse as sp
+
+    shift = sp.eye(N - 1, N, format="csr")
+    difference = sp.diags([np.ones(N - 1), -np.ones(N - 1)], [1, 0], shape=(N - 1, N))
+    return sp.hstack([dt * shift, difference, dt * shift], format="csr")
+
+
+def flowOptimisationLP(Lake, data, december_inflow, cache_dir=None):
+    """
+    Defines the desired optimisation as a sparse LP and solves it with HiGHS (scipy).
+    Returns optimised variables.
+    Reference formulation for flowOptimisation; slower but useful as a cross-check.
 
     :param Lake: Lake object with members e,Vmin,Vmax,Qmin,Qmax
     :param data: pandas dataframe with columns price, Inflow
-    :returns: Pyomo model
+    :param december_inflow: mean inflow in December [m3/s], sets the final volume
+    :param cache_dir: optional directory where solutions are stored, keyed by the inputs;
+                      a repeated call with the same lake and data skips building and solving
+    :returns: numpy arrays of optimised flow q [m3/s] and lake volume v [m3]
     """
-    # Create a model
-    model = pyo.ConcreteModel()
-
-    # Index set
-    N = range(len(data))  # 1h steps for 1 yr equivalent
-    model.N = pyo.Set(initialize=N)
-
-    # Parameters
-    model.e = pyo.Param(initialize=Lake.e)
-    model.P = pyo.Param(N, initialize=data["Price"].to_dict())
-    model.A = pyo.Param(N, initialize=data["Inflow"].to_dict())
-
-    # Variables
-    model.q = pyo.Var(N, bounds=(Lake.Qmin, Lake.Qmax))
-    model.v = pyo.Var(N, bounds=(Lake.Vmin, Lake.Vmax))
-    model.d = pyo.Var(N, domain=pyo.NonNegativeIntegers)
-
-    # Objective function
-    model.obj = pyo.Objective(
-        expr=model.e * sum(model.q[i] * 3600 * model.P[i] for i in N),
-        sense=pyo.maximize,
-    )
-
-    # Constraints
-    model.v[0].fix(Lake.V0)
-
-    def volume_condition(model, i):
-        if i == 0:
-            return pyo.Constraint.Skip  # Skip for the first index
-        return (
-            model.v[i]
-            == model.v[i - 1]
-            - model.q[i - 1] * 3600
-            - model.d[i - 1] * 3600
-            + model.A[i - 1] * 3600
-        )  # assume d(i) has units m3/s
-
-    model.balance = pyo.Constraint(model.N, rule=volume_condition)
+    if cache_dir is not None:
+        key = hashlib.blake2b(digest_size=16)
+        key.update(
+            np.array(
+                [
+                    Lake.e,
+                    Lake.Vmin,
+                    Lake.Vmax,
+                    Lake.Qmin,
+                    Lake.Qmax,
+                    Lake.coeff,
+                    december_inflow,
+                ],
+                dtype=np.float64,
+            ).tobytes()
+        )
+        for column in ("Price", "Inflow"):
+            key.update(data[column].to_numpy(dtype=np.float64).tobytes())
+        cache_file = os.path.join(
+            cache_dir, f"flowOptimisationLP_{key.hexdigest()}.npz"
+        )
+        if os.path.exists(cache_file):
+            with np.load(cache_file) as cached:
+                return cached["q"], cached["v"]
 
-    # v(TF) can be smaller than v(TF+1)=V0 maximally by A(TF). No maximum condition as d(i) can be arbitrarily big
-    final_volume_min = Lake.V0 - data.loc[data["Month"] == 12, "Inflow"].iloc[0] * 3600
-    model.final_condition = pyo.Constraint(expr=model.v[8759] >= final_volume_min)
+    from scipy.optimize import linprog  # only needed for this reference formulation
+
+    dt = 3600  # 1h steps [s]
+    N = len(data)  # 1h steps for 1 yr equivalent
+    prices = data["Price"].to_numpy(dtype=np.float64)
+    inflow = data["Inflow"].to_numpy(dtype=np.float64)
+
+    # Variables x = [q (N), v (N), d (N)], d being the spill [m3/s]
+    # Objective function, with e * 3600 * P folded into one coefficient per hour
+    # (linprog minimises, hence the sign)
+    c = np.zeros(3 * N)
+    c[:N] = -(Lake.e * dt) * prices
 
-    # Specify the solver
-    solver = pyo.SolverFactory("cbc")
+    # Constraints: v(i) - v(i-1) + (q(i-1) + d(i-1)) * 3600 = A(i-1) * 3600 for i >= 1
+    A_eq = balanceMatrix(N, dt)
+    b_eq = inflow[:-1] * dt
+
+    # v(TF) can be smaller than v(TF+1)=V0 maximally by A(TF). No maximum condition as d(i) can be arbitrarily big
+    final_volume_min = Lake.V0 - december_inflow * dt
+    bounds = np.empty((3 * N, 2))
+    bounds[:N] = (Lake.Qmin, Lake.Qmax)
+    bounds[N : 2 * N] = (Lake.Vmin, Lake.Vmax)
+    bounds[N] = (Lake.V0, Lake.V0)
+    bounds[2 * N - 1, 0] = max(Lake.Vmin, final_volume_min)
+    bounds[2 * N :] = (0, np.inf)
 
     # Solve the problem
-    result = solver.solve(model)
-    print("Status:", result.solver.status)
-    print("Termination Condition:", result.solver.termination_condition)
+    result = linprog(c, A_eq=A_eq, b_eq=b_eq, bounds=bounds, method="highs")
+    print("Status:", result.message)
+    # no solution (e.g. infeasible lake bounds), result.x is None
+    if result.status != 0:
+        raise RuntimeError(f"Flow optimisation failed: {result.message}")
+
+    q = result.x[:N]
+    v = result.x[N : 2 * N]
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(cache_file, q=q, v=v)
 
-    return model
+    return q, v
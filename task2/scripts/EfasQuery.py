@@ -1,10 +1,195 @@
-import cdsapi
-
-from utils import CheckAllowedOptions
+import functools
+import hashlib
+import json
+import math
+import operator
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import CheckAllowedOptions, _naturalKey
+
+# fixed according to instructions; can be made a variable
+_DATASET = "efas-forecast"
+
+# downloaded files, named by a hash of their query; entries are never evicted, delete the directory to free space
+_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "efas_cache")
+
+# cdsapi clients shared by all queries, one per wait_until_complete setting
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Allowed options of the EFAS forecast dataset, built once at import
+_SYSTEM_VERSIONS = frozenset(("operational", "version_4_0"))
+_CENTRES = frozenset(("ecmwf", "dwd", "cosmo_leps"))
+_PRODUCT_TYPES = frozenset(
+    ("control_forecast", "ensemble_perturbed_forecasts", "high_resolution_forecast")
+)
+_PRODUCT_TYPES_HRES = frozenset(("high_resolution_forecast",))
+_PRODUCT_TYPES_ENSEMBLE = frozenset(("ensemble_perturbed_forecasts",))
+_VARIABLES = frozenset(
+    ("river_discharge_in_the_last_6_hours", "river_discharge_in_the_last_24_hours")
+)
+_VARIABLES_6H = frozenset(("river_discharge_in_the_last_6_hours",))
+_MODEL_LEVELS = frozenset(("surface_level", "soil_levels"))
+_MODEL_LEVELS_SURFACE = frozenset(("surface_level",))
+_SOIL_LEVELS = frozenset(("1", "2", "3"))
+_YEARS = frozenset(("2018", "2019", "2020", "2021", "2022", "2023", "2024"))
+_YEARS_24H = frozenset(("2018", "2019", "2020"))
+_YEARS_VERSION_4_0 = frozenset(("2023",))
+_MONTHS = frozenset(f"{month:02d}" for month in range(1, 13))
+_MONTHS_2018 = frozenset(("October", "November", "December"))
+_MONTHS_2023 = frozenset(
+    (
+        "January",
+        "February",
+        "March",
+        "April",
+        "May",
+        "June",
+        "July",
+        "August",
+        "September",
+    )
+)
+_MONTHS_2024 = frozenset(("May", "June", "July", "August", "September", "October"))
+_MONTHS_VERSION_4_0 = frozenset(("September",))
+_DAYS = frozenset(f"{day:02d}" for day in range(1, 32))
+_DAYS_VERSION_4_0 = frozenset(("19",))
+_TIMES = frozenset(("00:00", "12:00"))
+_TIMES_VERSION_4_0 = frozenset(("12:00",))
+_LEADTIMES = frozenset(str(hour) for hour in range(0, 361, 6))
+_LEADTIMES_DWD = frozenset(str(hour) for hour in range(0, 169, 6))
+_LEADTIMES_COSMO = frozenset(str(hour) for hour in range(0, 133, 6))
+_LEADTIMES_HRES = frozenset(str(hour) for hour in range(0, 241, 6))
+# multiples of 24 hours, plus 64 as listed by the dataset
+_LEADTIMES_24H = frozenset(str(hour) for hour in (*range(24, 361, 24), 64))
+_DOWNLOAD_FORMATS = frozenset(("unarchived", "zip"))
+
+# Validation rules (condition attribute, condition value, attribute, allowed options), checked in order.
+# Rules without a condition always apply; conditional ones only if the condition attribute equals the value.
+_RULES = (
+    # system version
+    (None, None, "system_version", _SYSTEM_VERSIONS),
+    ("system_version", ("version_4_0",), "variable", _VARIABLES_6H),
+    ("system_version", ("version_4_0",), "year", _YEARS_VERSION_4_0),
+    ("system_version", ("version_4_0",), "month", _MONTHS_VERSION_4_0),
+    ("system_version", ("version_4_0",), "day", _DAYS_VERSION_4_0),
+    ("system_version", ("version_4_0",), "time", _TIMES_VERSION_4_0),
+    # originating_centre
+    (None, None, "originating_centre", _CENTRES),
+    ("originating_centre", "dwd", "product_type", _PRODUCT_TYPES_HRES),
+    ("originating_centre", "dwd", "variable", _VARIABLES_6H),
+    ("originating_centre", "dwd", "leadtime_hour", _LEADTIMES_DWD),
+    ("originating_centre", "cosmo_leps", "product_type", _PRODUCT_TYPES_ENSEMBLE),
+    ("originating_centre", "cosmo_leps", "variable", _VARIABLES_6H),
+    ("originating_centre", "cosmo_leps", "leadtime_hour", _LEADTIMES_COSMO),
+    # product_type
+    (None, None, "product_type", _PRODUCT_TYPES),
+    ("product_type", ("high_resolution_forecast",), "variable", _VARIABLES_6H),
+    ("product_type", ("high_resolution_forecast",), "leadtime_hour", _LEADTIMES_HRES),
+    # variable
+    (None, None, "variable", _VARIABLES),
+    (
+        "variable",
+        ("river_discharge_in_the_last_6_hours",),
+        "model_levels",
+        _MODEL_LEVELS_SURFACE,
+    ),
+    (
+        "variable",
+        ("river_discharge_in_the_last_24_hours",),
+        "model_levels",
+        _MODEL_LEVELS_SURFACE,
+    ),
+    ("variable", ("river_discharge_in_the_last_24_hours",), "year", _YEARS_24H),
+    (
+        "variable",
+        ("river_discharge_in_the_last_24_hours",),
+        "leadtime_hour",
+        _LEADTIMES_24H,
+    ),
+    # model levels
+    (None, None, "model_levels", _MODEL_LEVELS),
+    # year; assume the system can handle cases where multiple year/month combinations are given
+    (None, None, "year", _YEARS),
+    ("year", ("2018",), "month", _MONTHS_2018),
+    ("year", ("2023",), "month", _MONTHS_2023),
+    ("year", ("2024",), "month", _MONTHS_2024),
+    # month, day (assume the system can handle itself which are the possible days in month), time, leadtime_hour
+    (None, None, "month", _MONTHS),
+    (None, None, "day", _DAYS),
+    (None, None, "time", _TIMES),
+    (None, None, "leadtime_hour", _LEADTIMES),
+    # download_format
+    (None, None, "download_format", _DOWNLOAD_FORMATS),
+)
+
+# parameters always sent in a query, fetched together with one attrgetter call
+_QUERY_FIELDS = (
+    "system_version",
+    "originating_centre",
+    "product_type",
+    "variable",
+    "model_levels",
+    "year",
+    "month",
+    "day",
+    "time",
+    "leadtime_hour",
+    "download_format",
+)
+_getQueryFields = operator.attrgetter(*_QUERY_FIELDS)
+
+# all parameters in the order of EfasQuery._key, and the list parameters EfasQuery.union merges
+_KEY_FIELDS = (
+    "system_version",
+    "originating_centre",
+    "product_type",
+    "variable",
+    "model_levels",
+    "soil_level",
+    "year",
+    "month",
+    "day",
+    "time",
+    "leadtime_hour",
+    "area",
+    "download_format",
+)
+_UNION_DIMENSIONS = (
+    "product_type",
+    "variable",
+    "year",
+    "month",
+    "day",
+    "time",
+    "leadtime_hour",
+)
+
+# list parameters a query can be split along
+_SPLIT_DIMENSIONS = (
+    "system_version",
+    "product_type",
+    "variable",
+    "year",
+    "month",
+    "day",
+    "time",
+    "leadtime_hour",
+)
 
 
 class EfasQuery:
-    """Class to generate query dictionaries to the EFAS forecast dataset."""
+    """
+    Class to generate query dictionaries to the EFAS forecast dataset.
+    Queries are immutable after construction: the query dictionary is built once and split_by, union and
+    downloadFile(variables=...) start from the constructor arguments, so reassigning an attribute has no effect.
+    Create a new EfasQuery to change a parameter.
+    """
 
     def __init__(
         self,
@@ -186,209 +371,129 @@ class EfasQuery:
 
 
         """
-        self.system_version = (
-            system_version if isinstance(system_version, list) else [system_version]
-        )
-        self.originating_centre = originating_centre
-        self.product_type = (
-            product_type if isinstance(product_type, list) else [product_type]
-        )
-        self.variable = variable if isinstance(variable, list) else [variable]
-        self.model_levels = model_levels
-        self.soil_level = soil_level
-        self.year = year if isinstance(year, list) else [year]
-        self.month = month if isinstance(month, list) else [month]
-        self.day = day if isinstance(day, list) else [day]
-        self.time = time if isinstance(time, list) else [time]
-        self.leadtime_hour = (
-            leadtime_hour if isinstance(leadtime_hour, list) else [leadtime_hour]
+        self._init_kwargs = dict(
+            system_version=system_version,
+            originating_centre=originating_centre,
+            product_type=product_type,
+            variable=variable,
+            model_levels=model_levels,
+            year=year,
+            month=month,
+            day=day,
+            time=time,
+            leadtime_hour=leadtime_hour,
+            soil_level=soil_level,
+            area=area,
+            download_format=download_format,
         )
-        self.area = area
-        self.data_format = "netcdf"
-        self.download_format = download_format
+        self._setParameters(self._init_kwargs)
 
         self.validate_parameters()
 
-    def validate_parameters(self):
+    def _setParameters(self, kwargs):
         """
-        Validates the input parameters based on dataset constraints.
-        Raises ValueError if any parameter is invalid or the combination of parameters is not allowed.
+        Stores constructor arguments as attributes, wrapping single values into tuples.
+
+        :param kwargs: dict of constructor arguments
         """
-        # Validate system version
-        CheckAllowedOptions(self.system_version, ["operational", "version_4_0"])
-        if self.system_version == ["version_4_0"]:
-            CheckAllowedOptions(self.variable, ["river_discharge_in_the_last_6_hours"])
-            CheckAllowedOptions(self.year, ["2023"])
-            CheckAllowedOptions(self.month, ["September"])
-            CheckAllowedOptions(self.day, ["19"])
-            CheckAllowedOptions(self.time, ["12:00"])
-
-        # Validate originating_centre
-        CheckAllowedOptions(self.originating_centre, ["ecmwf", "dwd", "cosmo_leps"])
-        if self.originating_centre == "dwd":
-            CheckAllowedOptions(self.product_type, ["high_resolution_forecast"])
-            CheckAllowedOptions(self.variable, ["river_discharge_in_the_last_6_hours"])
-            CheckAllowedOptions(
-                self.leadtime_hour,
-                [
-                    "0",
-                    "6",
-                    "12",
-                    "18",
-                    "24",
-                    "30",
-                    "36",
-                    "42",
-                    "48",
-                    "54",
-                    "60",
-                    "66",
-                    "72",
-                    "78",
-                    "84",
-                    "90",
-                    "96",
-                    "102",
-                    "108",
-                    "114",
-                    "120",
-                    "126",
-                    "132",
-                    "138",
-                    "144",
-                    "150",
-                    "156",
-                    "162",
-                    "168",
-                ],
-            )
-        if self.originating_centre == "cosmo_leps":
-            CheckAllowedOptions(self.product_type, ["ensemble_perturbed_forecasts"])
-            CheckAllowedOptions(self.variable, ["river_discharge_in_the_last_6_hours"])
-            CheckAllowedOptions(
-                self.leadtime_hour,
-                [
-                    "0",
-                    "6",
-                    "12",
-                    "18",
-                    "24",
-                    "30",
-                    "36",
-                    "42",
-                    "48",
-                    "54",
-                    "60",
-                    "66",
-                    "72",
-                    "78",
-                    "84",
-                    "90",
-                    "96",
-                    "102",
-                    "108",
-                    "114",
-                    "120",
-                    "126",
-                    "132",
-                ],
-            )
+        self.system_version = _as_tuple(kwargs["system_version"])
+        self.originating_centre = kwargs["originating_centre"]
+        self.product_type = _as_tuple(kwargs["product_type"])
+        self.variable = _as_tuple(kwargs["variable"])
+        self.model_levels = kwargs["model_levels"]
+        self.soil_level = kwargs["soil_level"]
+        self.year = _as_tuple(kwargs["year"])
+        self.month = _as_tuple(kwargs["month"])
+        self.day = _as_tuple(kwargs["day"])
+        self.time = _as_tuple(kwargs["time"])
+        self.leadtime_hour = _as_tuple(kwargs["leadtime_hour"])
+        self.area = kwargs["area"]
+        self.data_format = "netcdf"
+        self.download_format = kwargs["download_format"]
 
-        # Validate product_type
-        CheckAllowedOptions(
+    def _key(self):
+        """
+        Returns a hashable tuple of all query parameters (in the order of _KEY_FIELDS),
+        used for equality and hashing.
+        """
+        return (
+            self.system_version,
+            self.originating_centre,
             self.product_type,
-            [
-                "control_forecast",
-                "ensemble_perturbed_forecasts",
-                "high_resolution_forecast",
-            ],
+            self.variable,
+            self.model_levels,
+            _as_tuple(self.soil_level) if self.soil_level else None,
+            self.year,
+            self.month,
+            self.day,
+            self.time,
+            self.leadtime_hour,
+            tuple(self.area) if self.area else None,
+            self.download_format,
         )
-        if self.product_type == ["high_resolution_forecast"]:
-            CheckAllowedOptions(self.variable, ["river_discharge_in_the_last_6_hours"])
-            CheckAllowedOptions(
-                self.leadtime_hour,
-                [
-                    "0",
-                    "6",
-                    "12",
-                    "18",
-                    "24",
-                    "30",
-                    "36",
-                    "42",
-                    "48",
-                    "54",
-                    "60",
-                    "66",
-                    "72",
-                    "78",
-                    "84",
-                    "90",
-                    "96",
-                    "102",
-                    "108",
-                    "114",
-                    "120",
-                    "126",
-                    "132",
-                    "138",
-                    "144",
-                    "150",
-                    "156",
-                    "162",
-                    "168",
-                    "174",
-                    "180",
-                    "186",
-                    "192",
-                    "198",
-                    "204",
-                    "210",
-                    "216",
-                    "222",
-                    "228",
-                    "234",
-                    "240",
-                ],
+
+    def __eq__(self, other):
+        if not isinstance(other, EfasQuery):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def split_by(self, dim="month", chunk=6):
+        """
+        Splits the query into smaller queries along one parameter, to keep single requests small.
+        Each sub-query is validated on its own: rules depend on the selected values (e.g. a 24h-only variable
+        restricts the years), so a sub-query of a valid query can be invalid, in which case ValueError is raised.
+
+        :param dim: name of a list parameter, e.g. "year", "month", "day" or "leadtime_hour"
+        :param chunk: maximal number of values of `dim` per sub-query
+        :returns: generator of EfasQuery objects
+        """
+        if dim not in _SPLIT_DIMENSIONS:
+            raise ValueError(
+                f"Cannot split along {dim}. Please choose among: {list(_SPLIT_DIMENSIONS)}."
             )
+        values = getattr(self, dim)
+        for i in range(0, len(values), chunk):
+            yield EfasQuery(**{**self._init_kwargs, dim: values[i : i + chunk]})
 
-        # Validate variable
-        CheckAllowedOptions(
-            self.variable,
-            [
-                "river_discharge_in_the_last_6_hours",
-                "river_discharge_in_the_last_24_hours",
-            ],
-        )
-        if self.variable == ["river_discharge_in_the_last_6_hours"]:
-            CheckAllowedOptions(self.model_levels, ["surface_level"])
-        if self.variable == ["river_discharge_in_the_last_24_hours"]:
-            CheckAllowedOptions(self.model_levels, ["surface_level"])
-            CheckAllowedOptions(self.year, ["2018", "2019", "2020"])
-            CheckAllowedOptions(
-                self.leadtime_hour,
-                [
-                    "24",
-                    "48",
-                    "64",
-                    "72",
-                    "96",
-                    "120",
-                    "144",
-                    "168",
-                    "192",
-                    "216",
-                    "240",
-                    "264",
-                    "288",
-                    "312",
-                    "336",
-                    "360",
-                ],
+    def union(self, other):
+        """
+        Merges two queries into one request, so they cost a single retrieval instead of two.
+        Both queries must agree on all parameters except the list parameters in _UNION_DIMENSIONS.
+        The merged query covers every combination of the merged values (e.g. all years with all months),
+        which can be more than the two queries asked for individually.
+
+        :param other: EfasQuery to merge with
+        :returns: merged (validated) EfasQuery
+        """
+        mismatched = [
+            name
+            for name, mine, theirs in zip(_KEY_FIELDS, self._key(), other._key())
+            if name not in _UNION_DIMENSIONS and mine != theirs
+        ]
+        if mismatched:
+            raise ValueError(f"Cannot merge queries that differ in: {mismatched}.")
+
+        merged = dict(self._init_kwargs)
+        for dim in _UNION_DIMENSIONS:
+            merged[dim] = sorted(
+                set(getattr(self, dim)) | set(getattr(other, dim)), key=_naturalKey
             )
+        return EfasQuery(**merged)
+
+    def validate_parameters(self):
+        """
+        Validates the input parameters based on dataset constraints.
+        Raises ValueError if any parameter is invalid or the combination of parameters is not allowed.
+        """
+        centre = self.originating_centre
+        _getValidator(
+            self.system_version, tuple(centre) if isinstance(centre, list) else centre
+        )(self)
 
-        # Validate model levels and soil level
-        CheckAllowedOptions(self.model_levels, ["surface_level", "soil_levels"])
+        # Validate soil level
         if self.model_levels == "soil_levels" and not self.soil_level:
             raise ValueError(
                 "Soil_level is required when model_levels is 'soil_levels'."
@@ -398,192 +503,35 @@ class EfasQuery:
                 raise ValueError(
                     "Soil_level should not be provided when model_levels is 'surface_level'."
                 )
-            CheckAllowedOptions(self.soil_level, ["1", "2", "3"])
+            CheckAllowedOptions(self.soil_level, _SOIL_LEVELS)
 
-        # Validate year
-        CheckAllowedOptions(
-            self.year, ["2018", "2019", "2020", "2021", "2022", "2023", "2024"]
-        )
-        if self.year == ["2018"]:
-            CheckAllowedOptions(self.month, ["October", "November", "December"])
-        if self.year == ["2023"]:
-            CheckAllowedOptions(
-                self.month,
-                [
-                    "January",
-                    "February",
-                    "March",
-                    "April",
-                    "May",
-                    "June",
-                    "July",
-                    "August",
-                    "September",
-                ],
-            )
-        if self.year == ["2024"]:
-            CheckAllowedOptions(
-                self.month, ["May", "June", "July", "August", "September", "October"]
-            )
-            # assume the system can handle cases where multiple year/month combinations are given
-
-        # validate month
-        CheckAllowedOptions(
-            self.month,
-            [
-                "01",
-                "02",
-                "03",
-                "04",
-                "05",
-                "06",
-                "07",
-                "08",
-                "09",
-                "10",
-                "11",
-                "12",
-            ],
-        )
-
-        # validate day
-        allowed_days = [
-            "01",
-            "02",
-            "03",
-            "04",
-            "05",
-            "06",
-            "07",
-            "08",
-            "09",
-            "10",
-            "11",
-            "12",
-            "13",
-            "14",
-            "15",
-            "16",
-            "17",
-            "18",
-            "19",
-            "20",
-            "21",
-            "22",
-            "23",
-            "24",
-            "25",
-            "26",
-            "27",
-            "28",
-            "29",
-            "30",
-            "31",
-        ]
-        CheckAllowedOptions(self.day, allowed_days)
-        # assume the system can handle itself which are the possible days in month
-
-        # Validate time
-        CheckAllowedOptions(self.time, ["00:00", "12:00"])
-
-        # Validate leadtime_hour
-        CheckAllowedOptions(
-            self.leadtime_hour,
-            [
-                "0",
-                "6",
-                "12",
-                "18",
-                "24",
-                "30",
-                "36",
-                "42",
-                "48",
-                "54",
-                "60",
-                "66",
-                "72",
-                "78",
-                "84",
-                "90",
-                "96",
-                "102",
-                "108",
-                "114",
-                "120",
-                "126",
-                "132",
-                "138",
-                "144",
-                "150",
-                "156",
-                "162",
-                "168",
-                "174",
-                "180",
-                "186",
-                "192",
-                "198",
-                "204",
-                "210",
-                "216",
-                "222",
-                "228",
-                "234",
-                "240",
-                "246",
-                "252",
-                "258",
-                "264",
-                "270",
-                "276",
-                "282",
-                "288",
-                "294",
-                "300",
-                "306",
-                "312",
-                "318",
-                "324",
-                "330",
-                "336",
-                "342",
-                "348",
-                "354",
-                "360",
-            ],
-        )
-
-        # Validate area
+        # Validate area; non-finite or inverted boxes would only be rejected by the server after queueing
         if self.area:
-            if (
-                not isinstance(self.area, list)
-                or len(self.area) != 4
-                or not all(isinstance(coord, (int, float)) for coord in self.area)
-            ):
+            try:
+                north, west, south, east = (float(coord) for coord in self.area)
+            except (TypeError, ValueError):
                 raise ValueError(
                     "Area must be a list of four numerical values [North, West, South, East]."
+                ) from None
+            if not all(map(math.isfinite, (north, west, south, east))):
+                raise ValueError("Area coordinates must be finite numbers.")
+            if not -90 <= south < north <= 90:
+                raise ValueError(
+                    "Area latitudes must satisfy -90 <= South < North <= 90."
                 )
+            # West > East is allowed, the box then crosses the antimeridian
+            self.area = [north, west, south, east]
 
-        # Validate download_format
-        CheckAllowedOptions(self.download_format, ["unarchived", "zip"])
-
-    def generateQuery(self):
+    @functools.cached_property
+    def _query(self):
         """
-        Generate a query dictionary based on the initialized parameters.
+        Query dictionary based on the initialized parameters, built once on first access.
+        Shared by the download methods and never handed out, so it cannot be modified by callers.
         """
+        # tuple parameters are sent as lists
         query = {
-            "system_version": self.system_version,
-            "originating_centre": self.originating_centre,
-            "product_type": self.product_type,
-            "variable": self.variable,
-            "model_levels": self.model_levels,
-            "year": self.year,
-            "month": self.month,
-            "day": self.day,
-            "time": self.time,
-            "leadtime_hour": self.leadtime_hour,
-            "download_format": self.download_format,
+            field: list(value) if isinstance(value, tuple) else value
+            for field, value in zip(_QUERY_FIELDS, _getQueryFields(self))
         }
 
         if self.soil_level:
@@ -592,19 +540,250 @@ class EfasQuery:
         if self.area:
             query["area"] = self.area
 
-        if self.download_format:
-            query["download_format"] = self.download_format
-
         return query
 
-    def downloadFile(self, output):
+    def generateQuery(self):
+        """
+        Generate a query dictionary based on the initialized parameters.
+        Returns a new dictionary (with new lists) on every call, so modifying it does not affect the query.
+        """
+        return {
+            field: list(value) if isinstance(value, list) else value
+            for field, value in self._query.items()
+        }
+
+    def downloadFile(self, output, use_cache=True, variables=None):
         """
         Submits the query and saves the file.
+        Files are kept in a local cache, so repeating an identical query copies the cached file instead of
+        submitting it again. Every downloaded file is therefore stored twice (output and cache), and the cache
+        is never evicted.
 
         :param output: output file location
+        :param use_cache: if False, the query is always submitted (the cache is still refreshed)
+        :param variables: optional subset of the query variables to download, so the server leaves out the others
         """
-        dataset = (
-            "efas-forecast"  # fixed according to instructions; can be made a variable
-        )
-        client = cdsapi.Client()
-        client.retrieve(dataset, self.generateQuery(), output)
+        if variables is not None:
+            variables = _as_tuple(variables)
+            if not frozenset(variables).issubset(self.variable):
+                raise ValueError(
+                    f"Variables {list(variables)} must be a subset of the query variables {list(self.variable)}."
+                )
+            if frozenset(variables) != frozenset(self.variable):
+                # validated again, rules may depend on which variables are requested
+                restricted = EfasQuery(
+                    **{**self._init_kwargs, "variable": list(variables)}
+                )
+                restricted.downloadFile(output, use_cache=use_cache)
+                return
+
+        query = self._query
+        cached = _cachePath(query)
+        if use_cache and _copyFromCache(cached, output):
+            return
+
+        _getClient().retrieve(_DATASET, query, output)
+        _storeInCache(output, cached)
+        _dropFromPageCache(output)
+
+    @classmethod
+    def downloadMany(cls, queries, outputs, max_inflight=4, use_cache=True):
+        """
+        Submits several queries at once and saves their files.
+        All requests are queued on the server before any download starts, so their queue
+        times overlap instead of adding up; completed requests are downloaded in parallel.
+        Queries found in the local cache (see downloadFile) are copied from it and not submitted.
+
+        :param queries: list of EfasQuery objects
+        :param outputs: list of output file locations, one per query
+        :param max_inflight: maximal number of simultaneous downloads
+        :param use_cache: if False, all queries are submitted (the cache is still refreshed)
+        """
+        if len(queries) != len(outputs):
+            raise ValueError("Number of queries and output locations must match.")
+
+        pending = []
+        for query, output in zip(queries, outputs):
+            cached = _cachePath(query._query)
+            if not (use_cache and _copyFromCache(cached, output)):
+                pending.append((query, output, cached))
+        if not pending:
+            return
+
+        client = _getClient(wait_until_complete=False)
+        results = [client.retrieve(_DATASET, query._query) for query, _, _ in pending]
+        with ThreadPoolExecutor(max_workers=max_inflight) as executor:
+            downloads = [
+                executor.submit(_waitAndDownload, result, output, cached)
+                for result, (_, output, cached) in zip(results, pending)
+            ]
+            for download in downloads:
+                download.result()  # re-raises errors of failed requests
+
+    # snake_case aliases of the public methods
+    generate_query = generateQuery
+    download_file = downloadFile
+    download_many = downloadMany
+
+
+def _as_tuple(value):
+    """
+    Wraps a single value into a tuple; lists and tuples are converted to tuples.
+
+    :param value: single value or list/tuple of values
+    """
+    return tuple(value) if isinstance(value, (list, tuple)) else (value,)
+
+
+@functools.lru_cache(maxsize=32)
+def _getValidator(system_version, originating_centre):
+    """
+    Returns a function validating the _RULES for queries with the given system version and centre.
+    Rules depending only on these two parameters are resolved once here, so the returned function only
+    evaluates the remaining conditions. Options of all applicable rules are intersected per attribute,
+    then each attribute is checked once.
+
+    :param system_version: tuple of system versions of the query
+    :param originating_centre: originating centre of the query
+    """
+    fixed = {
+        "system_version": system_version,
+        "originating_centre": originating_centre,
+    }
+    base = {}
+    remaining = []
+    for rule in _RULES:
+        condition_attr, condition_value, attr, options = rule
+        if condition_attr in fixed:
+            if fixed[condition_attr] != condition_value:
+                continue
+        elif condition_attr is not None:
+            remaining.append(rule)
+            continue
+        base[attr] = base[attr] & options if attr in base else options
+    remaining = tuple(remaining)
+
+    def validate(query):
+        allowed = dict(base)
+        for condition_attr, condition_value, attr, options in remaining:
+            if getattr(query, condition_attr) == condition_value:
+                allowed[attr] = allowed[attr] & options if attr in allowed else options
+        for attr, options in allowed.items():
+            CheckAllowedOptions(getattr(query, attr), options)
+
+    return validate
+
+
+def _getClient(wait_until_complete=True):
+    """
+    Returns a cdsapi client, created on first use and reused afterwards.
+    Reusing it avoids re-reading ~/.cdsapirc and keeps the HTTP session (and its connections) alive.
+
+    :param wait_until_complete: whether retrieve blocks until the request is completed
+    """
+    import cdsapi  # deferred, so building and validating queries does not load it
+
+    with _clients_lock:
+        if wait_until_complete not in _clients:
+            _clients[wait_until_complete] = cdsapi.Client(
+                wait_until_complete=wait_until_complete
+            )
+        return _clients[wait_until_complete]
+
+
+def _cachePath(query):
+    """
+    Returns the location of the cache entry of a query dictionary, named by a hash of the query.
+
+    :param query: query dictionary as submitted
+    """
+    key = hashlib.blake2b(
+        json.dumps(query, sort_keys=True).encode(), digest_size=16
+    ).hexdigest()
+    return os.path.join(_CACHE_DIR, key)
+
+
+def _copyFromCache(cached, output):
+    """
+    Copies a cache entry to the output location, if the entry exists.
+
+    :param cached: cache entry location
+    :param output: output file location
+    :returns: True if the file was copied from the cache
+    """
+    if not os.path.exists(cached):
+        return False
+    shutil.copyfile(cached, output)
+    # a cache hit should not wait for writeback
+    _dropFromPageCache(output, sync=False)
+    return True
+
+
+def _storeInCache(output, cached):
+    """
+    Stores a downloaded file as a cache entry.
+    The file is copied under a temporary name first, so an interrupted copy never leaves a truncated entry.
+
+    :param output: downloaded file location
+    :param cached: cache entry location
+    """
+    os.makedirs(_CACHE_DIR, exist_ok=True)
+    fd, partial = tempfile.mkstemp(dir=_CACHE_DIR, suffix=".part")
+    os.close(fd)
+    try:
+        shutil.copyfile(output, partial)
+        os.replace(partial, cached)
+    except BaseException:
+        os.remove(partial)
+        raise
+    _dropFromPageCache(cached)
+
+
+def _waitAndDownload(result, output, cached=None, poll_interval=5):
+    """
+    Waits until a submitted request is completed and saves its file.
+    Results of the legacy CDS API need polling; the current API (ecmwf.datastores Remote) waits within
+    download itself and raises if the request failed or was rejected.
+
+    :param result: object returned by a non-waiting cdsapi.Client.retrieve
+    :param output: output file location
+    :param cached: optional cache entry location the downloaded file is stored at
+    :param poll_interval: seconds between status checks
+    """
+    from cdsapi.api import (
+        Result,
+    )  # loaded already, the client that returned result comes from it
+
+    if isinstance(result, Result):
+        # any other state (completed, failed, rejected, ...) is final
+        while result.reply["state"] in ("queued", "accepted", "running"):
+            time.sleep(poll_interval)
+            result.update()
+        if result.reply["state"] != "completed":
+            raise RuntimeError(
+                f"Request {result.reply['state']}: {result.reply.get('error')}"
+            )
+    result.download(output)
+    if cached is not None:
+        _storeInCache(output, cached)
+    _dropFromPageCache(output)
+
+
+def _dropFromPageCache(path, sync=True):
+    """
+    Flushes a written file to disk and advises the kernel to drop it from the page cache,
+    so large downloads do not evict pages the rest of a pipeline is using.
+    Does nothing on platforms without posix_fadvise (e.g. Windows, macOS).
+
+    :param path: file location
+    :param sync: if False, the file is not flushed first; only pages already written back are dropped
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if sync:
+            os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
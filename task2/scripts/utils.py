@@ -1,14 +1,31 @@
+from collections.abc import Iterable
+
+
 def CheckAllowedOptions(variable, allowed_options):
     """
-    Auxiliary function to check whether a variable is in a list of allowed variables or a list of variables is a subset of the list  of allowed variables.
+    Auxiliary function to check whether a variable is in a set of allowed variables or a list of variables is a subset of the set of allowed variables.
+    The error message is only built on failure and names just the unsupported values.
     :param variable: variable or list of variables  to be checked
-    :param allowed_options: list of allowed options for this variable
+    :param allowed_options: frozenset of allowed options for this variable
     """
-    if isinstance(variable, list):
-        if set(variable).issubset(allowed_options):
+    if isinstance(variable, str) or not isinstance(variable, Iterable):
+        if variable in allowed_options:
             return
-    if variable in allowed_options:
-        return
+        unsupported = [variable]
+    else:
+        if allowed_options.issuperset(variable):
+            return
+        unsupported = sorted(set(variable).difference(allowed_options), key=_naturalKey)
     raise ValueError(
-        f"Option: {variable} unsupported or not compatible with other selected parameters. Please choose among available options: {allowed_options}."
+        f"Option: {', '.join(map(str, unsupported))} unsupported or not compatible with other selected parameters. Please choose among available options: {sorted(allowed_options, key=_naturalKey)}."
     )
+
+
+def _naturalKey(value):
+    """
+    Sort key placing numeric options in numerical order ("6" before "12") and other options after them, alphabetically.
+
+    :param value: option value
+    """
+    text = str(value)
+    return (0, int(text), text) if text.isdecimal() else (1, 0, text)